@@ -1,11 +1,15 @@
 import streamlit as st
 from google import genai
-from google.genai import types
-import pandas as pd
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
+from google.genai import types, errors
+import numpy as np
+from collections import Counter
 from datetime import datetime
-import time 
+import asyncio
+import concurrent.futures
+import hashlib
+import json
+import random
+import time
 
 # --- 1. CONFIGURATION & SETUP ---
 st.set_page_config(page_title="EdgeFinder AIS 8.0 (Phoenix)", layout="wide", page_icon="🔥")
@@ -16,17 +20,30 @@ try:
 except:
     API_KEY = "PASTE_YOUR_API_KEY_HERE"
 
-client = genai.Client(api_key=API_KEY)
+@st.cache_resource
+def get_client():
+    # One client per server process: keeps the HTTP connection pool warm
+    # instead of re-doing the TLS handshake on every script rerun.
+    return genai.Client(api_key=API_KEY)
+
+client = get_client()
 
 # --- 2. DATABASE CONNECTION (GOOGLE SHEETS) ---
 SCOPES = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
 
 @st.cache_resource(ttl=600)
 def get_database_connection():
+    # Deferred imports: gspread + google-auth cost hundreds of ms at cold
+    # start and scanner-only sessions never need them until this call.
+    import gspread
+    from google.oauth2.service_account import Credentials
     try:
         if "service_account" in st.secrets:
             creds_dict = dict(st.secrets["service_account"])
-            creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, SCOPES)
+            creds = Credentials.from_service_account_info(creds_dict, scopes=SCOPES)
+            # gspread wraps these creds in an AuthorizedSession (a pooled
+            # requests.Session with keep-alive), and cache_resource keeps it
+            # alive across reruns, so TLS/OAuth costs are paid once.
             client_gs = gspread.authorize(creds)
             sheet = client_gs.open("EdgeFinder_Database").get_worksheet(0)
             return sheet
@@ -36,19 +53,96 @@ def get_database_connection():
 
 db = get_database_connection()
 
+@st.cache_resource
+def get_executor():
+    # Shared worker pool: overlapping network calls + background audit runs
+    return concurrent.futures.ThreadPoolExecutor(max_workers=4)
+
 # --- 3. THE BRAIN (AIS 8.0 PHOENIX PROTOCOL) ---
-def get_learning_context():
+RESULT_COL = 4  # 1-based index of the 'Result' column in the sheet
+SPORT_COL = 2  # 1-based index of the 'Sport' column
+HISTORY_RANGE = "A:F"  # the real data columns — excludes the counter cells
+COUNTER_RANGE = "H1:I1"  # (TotalGraded, TotalWon), maintained on Locker Room sync
+
+@st.cache_data(ttl=300, show_spinner=False)
+def load_history_values():
+    # One Sheets round-trip per cache window, shared across sessions.
+    # Raw values (header row + data rows) skip gspread's per-row dict
+    # construction; the Locker Room builds the DataFrame straight from them.
+    # Restricted to HISTORY_RANGE so the H1:I1 counters never leak into the
+    # table as phantom columns (get_all_values pads rows to the widest row).
+    # The sheet is a singleton (module-level db), so no cache key args needed.
+    if db is None:
+        return []
+    return db.get_values(HISTORY_RANGE)
+
+@st.cache_data(ttl=300, show_spinner=False)
+def load_grade_counters():
+    # O(1) read: two counter cells instead of scanning the Result column.
+    # Returns None when the counters haven't been materialized yet.
+    if db is None:
+        return None
+    try:
+        cells = db.batch_get([COUNTER_RANGE])[0]
+        total_graded, wins = int(cells[0][0]), int(cells[0][1])
+        return wins, total_graded
+    except Exception:
+        return None
+
+@st.cache_data(ttl=300, show_spinner=False)
+def load_result_values():
+    # Narrow read for the Brain: one column instead of the whole sheet,
+    # so the payload is N cells rather than N rows x all columns.
+    if db is None:
+        return []
+    return db.col_values(RESULT_COL)[1:]  # skip header row
+
+@st.cache_data(ttl=300, show_spinner=False)
+def load_sport_results():
+    # Two-column batch read feeding the per-sport breakdown
+    if db is None:
+        return []
+    ranges = db.batch_get(["B:B", "D:D"])
+    sports = [row[0] if row else "" for row in ranges[0][1:]]
+    results = [row[0] if row else "" for row in ranges[1][1:]]
+    return list(zip(sports, results))
+
+def get_sport_win_rates():
+    # One Counter pass over the pre-fetched pairs — O(N) total instead of
+    # one filter scan per sport once the history grows.
+    counts = Counter(load_sport_results())
+    rates = {}
+    for sport_name in {key[0] for key in counts}:
+        wins = counts.get((sport_name, 'WON'), 0)
+        graded = wins + counts.get((sport_name, 'LOST'), 0)
+        if graded:
+            rates[sport_name] = (wins / graded * 100, graded)
+    return rates
+
+@st.cache_data(ttl=300, show_spinner=False)
+def get_learning_context(sport=None, rev=0):
+    # rev is the session's write counter: bumping it on saves/syncs forces a
+    # recompute, so repeat scans return this string with zero Python work.
     if db is None:
         return "System Status: New Database. No historical data available."
     try:
-        data = db.get_all_records()
-        df = pd.DataFrame(data)
-        if df.empty: return "History: Clean Slate."
-        if 'Result' not in df.columns: return "History: Database columns structure error."
-
-        wins = df[df['Result'] == 'WON'].shape[0]
-        total_graded = df[df['Result'].isin(['WON', 'LOST'])].shape[0]
-        
+        counters = load_grade_counters()
+        if counters is not None:
+            wins, total_graded = counters
+        else:
+            # Counters not materialized yet — fall back to the column scan
+            results = load_result_values()
+            if not results: return "History: Clean Slate."
+
+            # Single pass over the raw values — no DataFrame on the scan hot path
+            wins = total_graded = 0
+            for result in results:
+                if result == 'WON':
+                    wins += 1
+                    total_graded += 1
+                elif result == 'LOST':
+                    total_graded += 1
+
         if total_graded == 0: return "History: No graded bets yet."
             
         win_rate = (wins / total_graded) * 100
@@ -57,61 +151,331 @@ def get_learning_context():
             insight += "⚠️ CRITICAL ADJUSTMENT: Performance is low. ACTIVATE 'PROTOCOL C' (Safety First)."
         elif win_rate > 60:
             insight += "🔥 STATUS: Green Zone. Authorized for 'PROTOCOL B' (Variance/High Upside)."
+
+        if sport:
+            sport_rate = get_sport_win_rates().get(sport)
+            if sport_rate and sport_rate[1] >= 5:  # need a minimal sample
+                insight += f" {sport} Win Rate: {sport_rate[0]:.1f}% ({sport_rate[1]} graded)."
         return insight
     except Exception as e:
         return f"Error reading history: {str(e)}"
 
+PENDING_FLUSH_THRESHOLD = 5  # auto-push queued slips once this many pile up
+
+def flush_pending_slips():
+    # One append_rows call for however many slips are queued — N saves,
+    # one HTTP round-trip.
+    rows = st.session_state.get("pending_slips") or []
+    if not rows or db is None:
+        return
+    db.append_rows(rows, value_input_option="RAW")
+    st.session_state["pending_slips"] = []
+    st.session_state["sheet_rev"] = st.session_state.get("sheet_rev", 0) + 1
+    load_history_values.clear()
+    load_result_values.clear()
+    load_sport_results.clear()
+
 # --- 🔥 THE HYBRID GENERATOR ---
-def generate_hybrid(contents, use_search_tool, config):
-    # Model Priority List
-    model_candidates = [
-        'gemini-1.5-flash',
-        'gemini-1.5-flash-001',
-        'gemini-1.5-pro',
-        'gemini-2.0-flash-exp'
-    ]
-    
-    # If using search, we need a tool object
-    tools_list = [types.Tool(google_search=types.GoogleSearch())] if use_search_tool else None
-    
+# Model Priority List
+MODEL_CANDIDATES = [
+    'gemini-1.5-flash',
+    'gemini-1.5-flash-001',
+    'gemini-1.5-pro',
+    'gemini-2.0-flash-exp'
+]
+HEDGE_DELAY = 0.5  # seconds before the backup model is fired
+RETRY_DELAYS = [2, 5, 10, 20]  # escalating backoff for overloaded/throttled replies
+
+# Retry only what can succeed on retry; 400/401/403 fail fast, 404 means
+# "try the next model name".
+RETRYABLE_CODES = {429, 500, 502, 503, 504}
+
+def _backoff_delay(e, overload_hits):
+    # Honour the server's Retry-After hint when it sends one; otherwise use
+    # the backoff table plus random jitter so many sessions hitting the same
+    # 503 don't all re-wake in lockstep and fail together again.
+    try:
+        retry_after = e.response.headers.get("Retry-After")
+        if retry_after:
+            return float(retry_after)
+    except (AttributeError, TypeError, ValueError):
+        pass
+    delay = RETRY_DELAYS[min(overload_hits, len(RETRY_DELAYS) - 1)]
+    return delay + random.uniform(0, delay * 0.5)
+
+# Built once: proto construction (descriptor setup, field validation) isn't
+# free and these never change between calls.
+GOOGLE_SEARCH_TOOL = types.Tool(google_search=types.GoogleSearch())
+_SEARCH_TOOLS = [GOOGLE_SEARCH_TOOL]
+
+async def _generate_once_async(model_name, contents, run_config):
+    return await client.aio.models.generate_content(
+        model=model_name,
+        contents=contents,
+        config=run_config
+    )
+
+async def _hedged_generate_async(contents, run_config):
+    # Race the top two candidates: the backup fires only if the primary
+    # hasn't answered within HEDGE_DELAY, and the loser gets cancelled.
+    tasks = {asyncio.create_task(_generate_once_async(MODEL_CANDIDATES[0], contents, run_config))}
+    done, _ = await asyncio.wait(tasks, timeout=HEDGE_DELAY)
+    if not done:
+        tasks.add(asyncio.create_task(_generate_once_async(MODEL_CANDIDATES[1], contents, run_config)))
+
     last_error = None
-    
-    for model_name in model_candidates:
+    pending = tasks
+    while pending:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            if task.exception() is None:
+                for loser in pending:
+                    loser.cancel()
+                return task.result()
+            last_error = task.exception()
+    raise last_error
+
+async def generate_hybrid_async(contents, use_search_tool, system_instruction):
+    tools_list = _SEARCH_TOOLS if use_search_tool else None
+
+    run_config = types.GenerateContentConfig(
+        tools=tools_list,
+        system_instruction=system_instruction,
+        temperature=0.3
+    )
+
+    # Server-side cached prefix: only valid for the model it was created on
+    # and without tools, so it bypasses the hedge. Any failure (expired or
+    # evicted cache) falls through to the normal path.
+    if not use_search_tool and system_instruction == SYSTEM_INSTRUCTION_BASE:
+        cache_name = get_prompt_cache_name()
+        if cache_name:
+            try:
+                return await client.aio.models.generate_content(
+                    model=MODEL_CANDIDATES[1],
+                    contents=contents,
+                    config=types.GenerateContentConfig(
+                        cached_content=cache_name,
+                        temperature=0.3
+                    )
+                )
+            except Exception:
+                get_prompt_cache_name.clear()
+
+    # Fast path: hedge the two flash models so one cold 503 doesn't cost
+    # a full serial round-trip before we even try the backup.
+    try:
+        return await _hedged_generate_async(contents, run_config)
+    except errors.APIError as e:
+        # Search-quota exhaustion is terminal — surface it to the caller.
+        # (These may run on a worker thread, so no st.* calls in here.)
+        if e.code == 429 and use_search_tool:
+            raise
+        # Fail fast on 400/401/403 and friends: the ladder would only
+        # re-issue the same doomed request before raising anyway.
+        if e.code not in RETRYABLE_CODES and e.code != 404:
+            raise
+        # Otherwise fall back to the ordered serial ladder (404s and quota
+        # errors need graceful degradation, not racing).
+    except Exception:
+        pass  # network-level failure — the ladder gets its chance too
+
+    last_error = None
+    overload_hits = 0
+
+    for model_name in MODEL_CANDIDATES:
         try:
-            # Update config with specific tools for this run
-            run_config = types.GenerateContentConfig(
-                tools=tools_list,
-                system_instruction=config.system_instruction,
-                temperature=0.3
-            )
-            
-            return client.models.generate_content(
+            return await _generate_once_async(model_name, contents, run_config)
+        except errors.APIError as e:
+            last_error = e
+
+            # Quota Error (429) while using Search: we must STOP.
+            if e.code == 429 and use_search_tool:
+                raise
+
+            # Unknown model name: try the next candidate
+            if e.code == 404:
+                continue
+
+            # Transient server trouble: back off (with jitter) and degrade
+            if e.code in RETRYABLE_CODES:
+                await asyncio.sleep(_backoff_delay(e, overload_hits))
+                overload_hits += 1
+                continue
+
+            # 400/401/403 and friends — no retry budget can fix these
+            raise
+        except Exception as e:
+            last_error = e  # non-HTTP failure: give the next model a shot
+
+    if last_error:
+        raise last_error
+    return None
+
+def generate_hybrid(contents, use_search_tool, system_instruction):
+    # Thin sync shim so the Streamlit button handler stays unchanged
+    return asyncio.run(generate_hybrid_async(contents, use_search_tool, system_instruction))
+
+# --- 🌊 THE STREAMING GENERATOR ---
+async def generate_hybrid_stream_async(contents, use_search_tool, system_instruction, on_chunk):
+    # Same model ladder as generate_hybrid_async, but tokens are pushed to
+    # on_chunk as they arrive so the user sees text at time-to-first-token
+    # instead of staring at a spinner for the whole generation.
+    tools_list = _SEARCH_TOOLS if use_search_tool else None
+
+    run_config = types.GenerateContentConfig(
+        tools=tools_list,
+        system_instruction=system_instruction,
+        temperature=0.3
+    )
+
+    last_error = None
+    overload_hits = 0
+
+    for model_name in MODEL_CANDIDATES:
+        buf = []
+        try:
+            stream = await client.aio.models.generate_content_stream(
                 model=model_name,
                 contents=contents,
                 config=run_config
             )
-        except Exception as e:
-            error_msg = str(e)
+            async for chunk in stream:
+                if chunk.text:
+                    buf.append(chunk.text)
+                    on_chunk("".join(buf))
+            if buf:
+                return "".join(buf)
+            last_error = RuntimeError("Empty stream response")
+        except errors.APIError as e:
             last_error = e
-            
-            # If Quota Error (429) and we are using Search, we must STOP and warn user.
-            if ("429" in error_msg or "RESOURCE_EXHAUSTED" in error_msg) and use_search_tool:
-                st.error("🚨 DAILY SEARCH QUOTA REACHED! Please switch to 'Manual Mode' to continue.")
-                return None
-            
-            # If just a model name error (404), try next model
-            if "404" in error_msg or "NOT_FOUND" in error_msg:
+
+            # Don't retry mid-stream failures — the user already saw partial
+            # text and a rerun would silently duplicate tokens.
+            if buf:
+                break
+
+            # Terminal quota error — surface it. May run on a worker thread,
+            # so no st.* calls in here.
+            if e.code == 429 and use_search_tool:
+                raise
+
+            if e.code == 404:
                 continue
-                
-            # If Overloaded (503), wait brief moment
-            if "503" in error_msg:
-                time.sleep(2)
+
+            if e.code in RETRYABLE_CODES:
+                await asyncio.sleep(_backoff_delay(e, overload_hits))
+                overload_hits += 1
                 continue
-                
+
+            raise
+        except Exception as e:
+            last_error = e
+            if buf:
+                break
+
     if last_error:
-        st.error(f"❌ System Error: {last_error}")
+        raise last_error
     return None
 
+def generate_hybrid_stream(contents, use_search_tool, system_instruction, on_chunk):
+    return asyncio.run(generate_hybrid_stream_async(contents, use_search_tool, system_instruction, on_chunk))
+
+def run_scan_worker(prompt, use_search, buf):
+    # Executed on the worker pool: no Streamlit calls in here (worker threads
+    # have no script context). Streamed text lands in buf for the UI to poll.
+    def on_chunk(text):
+        buf[:] = [text]
+    return asyncio.run(
+        generate_hybrid_stream_async(prompt, use_search, SYSTEM_INSTRUCTION_BASE, on_chunk)
+    )
+
+# --- ⚡ SPLIT AUDIT (parallel fan-out) ---
+SPLIT_SECTIONS = [
+    ("1. HOME TEAM AUDIT", "Run ONLY the Traffic Light zone classification for the HOME team."),
+    ("2. AWAY TEAM AUDIT", "Run ONLY the Traffic Light zone classification for the AWAY team."),
+    ("3. KILL SWITCH + PHOENIX SLIP", "Run ONLY the Kill Switch check, then generate the Phoenix Slip (Max 3 Legs)."),
+]
+
+async def run_split_audit_async(base_prompt, history_tail, use_search, buf):
+    # The three sections are independent, so wall time collapses to the
+    # slowest sub-call instead of the sum. Sections land in buf as they
+    # finish (in stable order) so the poll loop shows progress.
+    results = [f"**{title}**\n\n⏳ _scanning..._" for title, _ in SPLIT_SECTIONS]
+
+    async def run_section(idx, title, instruction):
+        response = await generate_hybrid_async(
+            base_prompt + instruction + "\n" + history_tail,
+            use_search,
+            SYSTEM_INSTRUCTION_BASE
+        )
+        results[idx] = f"**{title}**\n\n" + (response.text if response else "_(no answer)_")
+        buf[:] = ["\n\n".join(results)]
+
+    await asyncio.gather(
+        *(run_section(i, title, instr) for i, (title, instr) in enumerate(SPLIT_SECTIONS))
+    )
+    return "\n\n".join(results)
+
+def run_split_scan_worker(base_prompt, history_tail, use_search, buf):
+    return asyncio.run(run_split_audit_async(base_prompt, history_tail, use_search, buf))
+
+# --- 💾 RESPONSE CACHE (Exact Match) ---
+RESPONSE_CACHE_TTL = 900
+
+@st.cache_resource
+def response_cache():
+    # Cross-session {key: (text, timestamp)} store. A plain dict instead of
+    # st.cache_data because cache misses now stream into the UI as tokens
+    # arrive, which can't happen inside a cached function.
+    return {}
+
+def response_cache_key(*parts):
+    payload = json.dumps([MODEL_CANDIDATES[0], 0.3, *parts], sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+def response_cache_get(key):
+    entry = response_cache().get(key)
+    if entry and time.time() - entry[1] < RESPONSE_CACHE_TTL:
+        return entry[0]
+    return None
+
+def response_cache_put(key, text):
+    response_cache()[key] = (text, time.time())
+
+# --- 🧠 SEMANTIC CACHE (Near-Duplicate Prompts) ---
+# "Man Utd" vs "Manchester United" should hit the same cached audit.
+SEM_CACHE_THRESHOLD = 0.92
+SEM_CACHE_TTL = 3600
+SEM_CACHE_MAX = 500
+
+def embed_prompt(text):
+    result = client.models.embed_content(model='text-embedding-004', contents=text)
+    vec = np.array(result.embeddings[0].values, dtype=np.float32)
+    return vec / np.linalg.norm(vec)
+
+def semantic_cache_get(prompt):
+    try:
+        vec = embed_prompt(prompt)
+    except Exception:
+        return None, None  # Embedding down? Just skip the semantic layer.
+    cache = st.session_state.setdefault("sem_cache", [])
+    now = time.time()
+    cache[:] = [entry for entry in cache if now - entry[2] < SEM_CACHE_TTL]
+    if cache:
+        sims = np.stack([entry[0] for entry in cache]) @ vec
+        best = int(np.argmax(sims))
+        if sims[best] > SEM_CACHE_THRESHOLD:
+            return cache[best][1], vec
+    return None, vec
+
+def semantic_cache_put(vec, text):
+    if vec is None:
+        return
+    cache = st.session_state.setdefault("sem_cache", [])
+    cache.append((vec, text, time.time()))
+    del cache[:-SEM_CACHE_MAX]
+
 # --- AIS 8.0 MASTER PROMPT ---
 SYSTEM_INSTRUCTION_BASE = """
 You are EdgeFinder (AIS 8.0 Phoenix).
@@ -151,17 +515,46 @@ You must output your analysis in this EXACT format:
 * [ ] No Red Zone Win Bets?
 """
 
+# Fixed halves of the dynamic prompt tail, concatenated around the live
+# history context — plain + beats re-parsing an f-string template per scan.
+_CONTEXT_PREFIX = "CURRENT LEARNING CONTEXT: "
+_STEP4_SUFFIX = "\nSTEP 4: Generate the PHOENIX SLIP based on that context.\n"
+
+# --- 🗄️ SERVER-SIDE PROMPT CACHE (Gemini cachedContents) ---
+@st.cache_resource
+def get_prompt_cache_name():
+    # Explicit prefix cache for the master prompt, billed at the cached-read
+    # discount. Models enforce a minimum cached-token count, so this can
+    # legitimately fail for a short instruction — then we return None and
+    # keep sending system_instruction, relying on implicit prefix caching.
+    try:
+        cache = client.caches.create(
+            model=MODEL_CANDIDATES[1],  # explicit caches need a versioned model
+            config=types.CreateCachedContentConfig(
+                system_instruction=SYSTEM_INSTRUCTION_BASE,
+                ttl='3600s',
+            ),
+        )
+        return cache.name
+    except Exception:
+        return None
+
 # --- 4. CUSTOM CSS ---
-st.markdown("""
+_CSS = """
 <style>
     .stApp { background-color: #0b0f19; color: #e0e0e0; }
     .stTextInput > div > div > input { background-color: #1a1f2e; color: white; border: 1px solid #30364d; }
     .stTextArea > div > div > textarea { background-color: #1a1f2e; color: #00ffcc; border: 1px solid #30364d; font-family: monospace; }
-    .metric-card { background-color: #131722; border: 1px solid #2a2e39; padding: 20px; border-radius: 12px; margin-bottom: 15px;}
+    div[data-testid="stVerticalBlockBorderWrapper"] { background-color: #131722; border-color: #2a2e39; border-radius: 12px; }
     .stButton > button { background: linear-gradient(90deg, #FF416C 0%, #FF4B2B 100%); color: white; font-weight: bold; border: none; }
     div[data-testid="stDataFrame"] { background-color: #1a1f2e; }
 </style>
-""", unsafe_allow_html=True)
+"""
+
+# Re-injected on every rerun on purpose: Streamlit removes DOM elements that
+# aren't re-emitted, so caching this call would strip the theme on the next
+# widget interaction. Only the string build is hoisted.
+st.markdown(_CSS, unsafe_allow_html=True)
 
 # --- 5. MAIN INTERFACE ---
 st.title("🔥 EdgeFinder AIS 8.0 (Phoenix Protocol)")
@@ -173,92 +566,250 @@ tab1, tab2 = st.tabs(["🔎 PHOENIX SCANNER", "📂 LOCKER ROOM (History)"])
 
 # === TAB 1: THE SCANNER ===
 with tab1:
-    col1, col2 = st.columns(2)
-    with col1:
-        st.markdown('<div class="metric-card">', unsafe_allow_html=True)
-        st.markdown("### 🏠 HOME TEAM")
-        home_team = st.text_input("Home Input", placeholder="e.g. Fiorentina", label_visibility="collapsed")
-        st.markdown('</div>', unsafe_allow_html=True)
-    with col2:
-        st.markdown('<div class="metric-card">', unsafe_allow_html=True)
-        st.markdown("### ✈️ AWAY TEAM")
-        away_team = st.text_input("Away Input", placeholder="e.g. Dynamo Kyiv", label_visibility="collapsed")
-        st.markdown('</div>', unsafe_allow_html=True)
-
-    sport = st.selectbox("Sport", ["Football ⚽ (UEFA/Leagues)", "NBA 🏀", "NFL 🏈"])
-
     # --- 🎛️ CONTROL CENTER ---
+    # Kept outside the form: flipping the source has to rerun immediately so
+    # the Intel Stream textarea can appear/disappear.
     st.markdown("### 📡 DATA SOURCE")
-    mode = st.radio("Select Intelligence Source:", 
-             ["🟢 Auto-Pilot (Google Search)", "🟠 Manual Intel (Paste Data - Unlimited)"],
+    mode = st.radio("Select Intelligence Source:",
+             ["🟢 Auto-Pilot (Google Search — slower, burns search quota)", "🟠 Manual Intel (Paste Data - Unlimited)"],
+             index=1,
              horizontal=True)
 
-    user_context = ""
+    split_audit = st.checkbox(
+        "⚡ Split Audit (run Home/Away/Kill-Switch scans in parallel)",
+        value=False,
+        help="Three smaller concurrent calls instead of one streamed audit — faster wall time, more quota."
+    )
+
     if "Manual" in mode:
         st.info("💡 **SCOUT INSTRUCTION:** Go to Flashscore/SofaScore. Copy the 'Match Summary', 'Lineups', or 'Last 5 Matches' and paste it below. The AI will extract the Fatigue & Form data for you.")
-        user_context = st.text_area("📋 Intel Stream (Paste Text Here)", height=150, placeholder="Example: \n- Liverpool played 3 days ago (Fatigue High)\n- Salah is benched\n- Last 5 games: W W L D W")
 
-    if st.button("🚀 RUN TRAFFIC LIGHT AUDIT", use_container_width=True):
+    # The inputs live in a form so typing batches into ONE rerun on submit
+    # instead of a full script pass per widget interaction.
+    with st.form("phoenix_audit"):
+        col1, col2 = st.columns(2)
+        with col1:
+            with st.container(border=True):
+                st.markdown("### 🏠 HOME TEAM")
+                home_team = st.text_input("Home Input", placeholder="e.g. Fiorentina", label_visibility="collapsed")
+        with col2:
+            with st.container(border=True):
+                st.markdown("### ✈️ AWAY TEAM")
+                away_team = st.text_input("Away Input", placeholder="e.g. Dynamo Kyiv", label_visibility="collapsed")
+
+        sport = st.selectbox("Sport", ["Football ⚽ (UEFA/Leagues)", "NBA 🏀", "NFL 🏈"])
+
+        user_context = ""
+        if "Manual" in mode:
+            user_context = st.text_area("📋 Intel Stream (Paste Text Here)", height=150, placeholder="Example: \n- Liverpool played 3 days ago (Fatigue High)\n- Salah is benched\n- Last 5 games: W W L D W")
+
+        submitted = st.form_submit_button("🚀 RUN TRAFFIC LIGHT AUDIT", use_container_width=True)
+
+    if submitted:
         if not home_team or not away_team:
             st.error("Enter both teams.")
+        elif "scan_job" in st.session_state:
+            st.warning("⏳ An audit is already running — hang tight.")
         else:
             with st.spinner("Connecting to AIS 8.0... Running Structural Diagnostics..."):
-                history_context = get_learning_context()
-                
+                # Sheets round-trip and prompt embedding are independent network
+                # calls — run the history pull on a worker while we embed.
+                history_future = get_executor().submit(
+                    get_learning_context, sport, st.session_state.get("sheet_rev", 0)
+                )
+
                 # Determine source logic
                 use_search = "Auto" in mode
-                
-                final_system_instruction = f"{SYSTEM_INSTRUCTION_BASE}\n\nCURRENT LEARNING CONTEXT: {history_context}"
-                
-                prompt = f"""
+
+                if use_search:
+                    intel_block = "STEP 1: Search for LATEST Lineups, Injuries, and Schedule (Fatigue)."
+                else:
+                    intel_block = f"🚨 USER INTEL:\n{user_context}"
+
+                # History-free base prompt: used for the semantic cache key so a
+                # win-rate tick doesn't invalidate every cached audit.
+                base_prompt = f"""
                 Run a full PHOENIX AUDIT on {home_team} vs {away_team} ({sport}).
-                
+
                 SOURCE DATA: {"GOOGLE SEARCH (LIVE)" if use_search else "USER PROVIDED INTEL (BELOW)"}
-                
-                {f'🚨 USER INTEL:\n{user_context}' if not use_search else 'STEP 1: Search for LATEST Lineups, Injuries, and Schedule (Fatigue).'}
-                
-                CRITICAL INSTRUCTION: 
+
+                {intel_block}
+
+                CRITICAL INSTRUCTION:
                 If using User Intel, extract FATIGUE (days since last game) and FORM (last 5 results) from the text to determine the Traffic Light Status.
-                
+
                 STEP 2: Classify both teams as GREEN, YELLOW, or RED ZONE.
                 STEP 3: Check against the KILL SWITCH LAWS.
-                STEP 4: Generate the PHOENIX SLIP based on {history_context}.
                 """
-                
+
                 try:
-                    # Pass the mock config object simply to carry instructions
-                    # The function 'generate_hybrid' handles the messy API logic
-                    class MockConfig:
-                        system_instruction = final_system_instruction
-                        
-                    response = generate_hybrid(
-                        contents=prompt,
-                        use_search_tool=use_search,
-                        config=MockConfig()
+                    # Layer 0: double-click guard — the same submit within 30s
+                    # replays this session's last slip, no cache machinery at all
+                    scan_key = hashlib.sha1(
+                        f"{home_team}|{away_team}|{sport}|{mode}|{user_context}|{split_audit}".encode()
+                    ).hexdigest()
+                    response_text = None
+                    if (st.session_state.get("last_scan_key") == scan_key
+                            and time.time() - st.session_state.get("last_scan_ts", 0.0) < 30):
+                        response_text = st.session_state.get("last_response_text")
+
+                    # Layer 1: exact-match cache — no network at all on a hit
+                    # Keyed per calendar day and case-insensitively on team names:
+                    # lineups/injuries go stale overnight, but "MAN UTD" and
+                    # "man utd" are the same scan.
+                    cache_key = response_cache_key(
+                        home_team.strip().lower(),
+                        away_team.strip().lower(),
+                        sport, mode, user_context, split_audit,
+                        datetime.now().strftime("%Y-%m-%d"),
                     )
-                    
-                    if response:
-                        st.markdown("---")
-                        st.markdown(f"**🧠 NEURAL CONTEXT:** `{history_context}`")
-                        st.markdown(response.text)
-                        
-                        if db:
-                            st.markdown("---")
-                            if st.button("💾 Save Phoenix Slip"):
-                                current_time = datetime.now().strftime("%Y-%m-%d")
-                                db.append_row([current_time, sport, f"{home_team} vs {away_team}", "Pending", "0", "Pending"])
-                                st.toast("Bet Saved to Locker Room!")
+                    if response_text is None:
+                        response_text = response_cache_get(cache_key)
+                    prompt_vec = None
+
+                    # Layer 2: paraphrased repeats ("Man Utd" vs "Manchester United")
+                    if response_text is None:
+                        response_text, prompt_vec = semantic_cache_get(base_prompt)
+
+                    history_context = history_future.result()
+                    # System instruction stays byte-identical across calls so
+                    # Gemini's implicit prompt cache can reuse the prefix; the
+                    # volatile learning context rides at the end of the contents.
+                    history_tail = _CONTEXT_PREFIX + history_context + _STEP4_SUFFIX
+                    prompt = base_prompt + history_tail
+
+                    if response_text is None:
+                        # Cache miss: hand the generation to a worker thread so
+                        # the UI (and the Locker Room tab) stays responsive.
+                        buf = []
+                        if split_audit:
+                            scan_future = get_executor().submit(
+                                run_split_scan_worker, base_prompt, history_tail, use_search, buf
+                            )
+                        else:
+                            scan_future = get_executor().submit(run_scan_worker, prompt, use_search, buf)
+                        st.session_state["scan_job"] = {
+                            "future": scan_future,
+                            "buf": buf,
+                            "cache_key": cache_key,
+                            "scan_key": scan_key,
+                            "vec": prompt_vec,
+                            "history": history_context,
+                            "use_search": use_search,
+                            "match": (sport, f"{home_team} vs {away_team}"),
+                        }
+                    else:
+                        st.session_state["last_scan_key"] = scan_key
+                        st.session_state["last_scan_ts"] = time.time()
+                        st.session_state["last_response_text"] = response_text
+                        st.session_state["scan_result"] = {
+                            "text": response_text,
+                            "history": history_context,
+                            "match": (sport, f"{home_team} vs {away_team}"),
+                        }
                 except Exception as e:
                     st.error(f"AIS Core Error: {e}")
 
+    # --- 📺 SCAN OUTPUT (top-level so reruns keep it on screen) ---
+    scan_job = st.session_state.get("scan_job")
+    if scan_job:
+        if scan_job["future"].done():
+            del st.session_state["scan_job"]
+            try:
+                scan_text = scan_job["future"].result()
+            except Exception as e:
+                error_msg = str(e)
+                if ("429" in error_msg or "RESOURCE_EXHAUSTED" in error_msg) and scan_job["use_search"]:
+                    st.error("🚨 DAILY SEARCH QUOTA REACHED! Please switch to 'Manual Mode' to continue.")
+                else:
+                    st.error(f"❌ System Error: {e}")
+                scan_text = None
+            if scan_text:
+                response_cache_put(scan_job["cache_key"], scan_text)
+                semantic_cache_put(scan_job["vec"], scan_text)
+                st.session_state["last_scan_key"] = scan_job["scan_key"]
+                st.session_state["last_scan_ts"] = time.time()
+                st.session_state["last_response_text"] = scan_text
+                st.session_state["scan_result"] = {
+                    "text": scan_text,
+                    "history": scan_job["history"],
+                    "match": scan_job["match"],
+                }
+        else:
+            # In-flight: render whatever has streamed in so far. The actual
+            # poll rerun is scheduled at the very end of the script so the
+            # Locker Room tab still renders while the audit runs.
+            st.markdown("---")
+            st.markdown(f"**🧠 NEURAL CONTEXT:** `{scan_job['history']}`")
+            st.markdown("".join(scan_job["buf"]) or "⏳ _Running Structural Diagnostics..._")
+
+    scan_result = st.session_state.get("scan_result")
+    if scan_result:
+        st.markdown("---")
+        st.markdown(f"**🧠 NEURAL CONTEXT:** `{scan_result['history']}`")
+        st.markdown(scan_result["text"])
+
+        if db:
+            if st.button("💾 Save Phoenix Slip"):
+                current_time = datetime.now().strftime("%Y-%m-%d")
+                slip_sport, slip_match = scan_result["match"]
+                st.session_state.setdefault("pending_slips", []).append(
+                    [current_time, slip_sport, slip_match, "Pending", "0", "Pending"]
+                )
+                if len(st.session_state["pending_slips"]) >= PENDING_FLUSH_THRESHOLD:
+                    flush_pending_slips()
+                    st.toast("Slip queue full — synced to Locker Room!")
+                else:
+                    st.toast("Slip queued — sync below to push to the cloud.")
+
+    # --- 💾 PENDING SLIPS (batched saves — one API call for N slips) ---
+    pending_slips = st.session_state.get("pending_slips", [])
+    if pending_slips and db:
+        if st.button(f"⬆️ Sync {len(pending_slips)} Pending Slip(s) to Locker Room"):
+            flush_pending_slips()
+            st.toast("Slips synced to Locker Room!")
+
 # === TAB 2: LOCKER ROOM (HISTORY) ===
 with tab2:
     st.header("📂 Betting History")
-    if db:
+
+    # Report on any background sync kicked off by an earlier rerun. Caches
+    # are only invalidated once the write has actually landed.
+    pending_write = st.session_state.get("pending_write")
+    if pending_write is not None:
+        if pending_write.done():
+            del st.session_state["pending_write"]
+            sync_error = pending_write.exception()
+            if sync_error:
+                st.error(f"❌ Cloud sync failed: {sync_error}")
+            else:
+                st.session_state["sheet_rev"] = st.session_state.get("sheet_rev", 0) + 1
+                load_history_values.clear()
+                load_result_values.clear()
+                load_sport_results.clear()
+                load_grade_counters.clear()
+                st.toast("✅ Synced to Cloud!")
+        else:
+            st.caption("☁️ Syncing to Cloud in the background...")
+
+    if db and not st.session_state.get("visited_locker"):
+        # st.tabs renders every tab's body on every rerun, so the history
+        # fetch + DataFrame build used to run even in scanner-only sessions.
+        # Load on first explicit visit, then stay loaded for the session.
+        if st.button("📂 Load Betting History", use_container_width=True):
+            st.session_state["visited_locker"] = True
+            st.rerun()
+    elif db:
         try:
-            data = db.get_all_records()
-            df = pd.DataFrame(data)
-            
+            import pandas as pd  # only the Locker Room needs pandas
+
+            values = load_history_values()
+            df = (
+                pd.DataFrame(values[1:], columns=values[0])
+                if len(values) > 1
+                else pd.DataFrame()
+            )
+
             if not df.empty:
                 edited_df = st.data_editor(
                     df,
@@ -274,14 +825,60 @@ with tab2:
                 )
                 
                 if st.button("🔄 Update Database"):
-                    with st.spinner("Syncing to Cloud..."):
-                        updated_data = [edited_df.columns.values.tolist()] + edited_df.values.tolist()
-                        db.update(updated_data, "A1") 
-                        st.success("Database Updated!")
-                        st.rerun()
+                    from gspread.utils import rowcol_to_a1
+
+                    # Refresh the O(1) grade counters in the same write call
+                    graded = edited_df["Result"].isin(["WON", "LOST"]).sum() if "Result" in edited_df.columns else 0
+                    won = (edited_df["Result"] == "WON").sum() if "Result" in edited_df.columns else 0
+                    updates = [{"range": COUNTER_RANGE, "values": [[int(graded), int(won)]]}]
+
+                    if edited_df.shape == df.shape:
+                        # Sparse diff against the loaded snapshot: push only
+                        # the cells the user actually touched, not the sheet
+                        changed = (edited_df != df) & ~(edited_df.isna() & df.isna())
+                        for row_idx, col_idx in zip(*changed.to_numpy().nonzero()):
+                            updates.append({
+                                # +2 = header row + 1-based sheet indexing
+                                "range": rowcol_to_a1(int(row_idx) + 2, int(col_idx) + 1),
+                                "values": [[edited_df.iat[row_idx, col_idx]]],
+                            })
+                    else:
+                        # Rows were added or deleted — full resync is safer.
+                        # itertuples streams rows without materializing the
+                        # whole .values object matrix a second time.
+                        header = edited_df.columns.tolist()
+                        body = map(list, edited_df.itertuples(index=False, name=None))
+                        updated_data = [header, *body]
+                        sync_range = f"A1:{rowcol_to_a1(len(updated_data), len(header))}"
+                        updates.append({"range": sync_range, "values": updated_data})
+
+                        # Deletions shrink the table: blank the rows between
+                        # the new and old extents, or they survive below the
+                        # rewrite and reappear on the next cache refresh.
+                        old_rows = len(values)
+                        if old_rows > len(updated_data):
+                            updates.append({
+                                "range": f"A{len(updated_data) + 1}:{rowcol_to_a1(old_rows, len(header))}",
+                                "values": [[""] * len(header)] * (old_rows - len(updated_data)),
+                            })
+
+                    # Fire-and-forget: the multi-second Sheets write runs on the
+                    # worker pool; the section above reports when it lands.
+                    # RAW skips server-side formula parsing for plain cells.
+                    st.session_state["pending_write"] = get_executor().submit(
+                        db.batch_update, updates, value_input_option="RAW"
+                    )
+                    st.success("Database update queued — syncing in the background.")
             else:
                 st.info("No bets saved yet.")
         except Exception as e:
             st.error(f"Error loading database: {e}")
     else:
         st.info("Connect Google Sheets to unlock History Tracking.")
+
+# --- ⏱️ SCAN POLL (must stay last: an st.rerun() inside tab1 would abort
+# the script before tab2 executes, blanking the Locker Room mid-audit) ---
+if "scan_job" in st.session_state:
+    if not st.session_state["scan_job"]["future"].done():
+        time.sleep(0.5)
+    st.rerun()